@@ -1,4 +1,5 @@
 import enum
+from types import MappingProxyType
 
 # Reference colors from W3
 # https://www.w3.org/wiki/CSS/Properties/color/keywords
@@ -150,3 +151,7 @@ class Color(enum.Enum):
     whitesmoke = [245, 245, 245]
     yellow = [255, 255, 0]
     yellowgreen = [154, 205, 50]
+
+# Name -> rgb lookup built once. Unlike Color._member_names_ it keeps the
+# aliases, e.g. 'cyan' and 'grey' share their value with 'aqua' and 'gray'
+COLOR_NAMES = MappingProxyType({name: tuple(color.value) for name, color in Color.__members__.items()})
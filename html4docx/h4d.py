@@ -19,19 +19,19 @@ import base64
 import urllib
 
 from io import BytesIO
+from functools import lru_cache
 from html.parser import HTMLParser
 
-from bs4 import BeautifulSoup
+from bs4 import BeautifulSoup, UnicodeDammit
 
 import docx
 from docx import Document
-from docx.shared import RGBColor, Pt, Cm, Inches
+from docx.shared import RGBColor, Pt, Cm, Inches, Emu
 from docx.enum.text import WD_ALIGN_PARAGRAPH
 from docx.oxml import OxmlElement
 from docx.oxml.ns import qn
 
 from html4docx import utils
-from html4docx.colors import Color
 
 # values in inches
 INDENT = 0.25
@@ -41,22 +41,67 @@ MAX_INDENT = 5.5 # To stop indents going off the page
 # Style to use with tables. By default no style is used.
 DEFAULT_TABLE_STYLE = None
 
+# Splits an inline style into (property, value) pairs in a single pass
+STYLE_DECLARATIONS = re.compile(r'([^:;]+):([^;]*)')
+
+# Patterns used while applying styles, compiled once instead of on every lookup
+DIGITS = re.compile(r'[0-9]+')
+UNIT_CHARACTERS = re.compile(r'[a-zA-Z\!\%]+')
+TRAILING_NON_DIGITS = re.compile(r'[^0-9]+$')
+CAPITALIZED_WORD = re.compile(r'[A-Z][^A-Z]*')
+HEADING_TAG = re.compile(r'h[1-9]')
+FONT_SIZE = re.compile(r'([0-9]*\.?[0-9]+)([a-zA-Z%]*)')
+
+# Length for each supported font-size unit
+FONT_SIZE_UNITS = {
+    'px': lambda size: Emu(utils.px_to_emu(size)),
+    'cm': Cm,
+    'pt': Pt,
+}
+
+# Parser used by BeautifulSoup to fix the html. 'lxml' is much faster than
+# 'html.parser' and always available since python-docx already depends on it.
+DEFAULT_HTML_PARSER = 'lxml'
+
+@lru_cache(maxsize=1024)
+def parse_declarations(string, separator=';'):
+    """
+    Splits a style string into (property, value) pairs.
+    Cached since the same inline styles repeat across elements.
+    """
+    if separator == ';':
+        declarations = STYLE_DECLARATIONS
+    else:
+        declarations = re.compile(r'([^:{0}]+):([^{0}]*)'.format(re.escape(separator)))
+    # Values may contain ':' themselves, e.g. url(http://...), so only the first one splits
+    return tuple(declarations.findall(string.replace(" ", '')))
+
 class HtmlToDocx(HTMLParser):
     def __init__(self):
         super().__init__()
-        self.options = {
-            'fix-html': True,
-            'images': True,
-            'tables': True,
-            'styles': True,
-        }
         self.table_row_selectors = [
             'table > tr',
             'table > thead > tr',
             'table > tbody > tr',
             'table > tfoot > tr'
         ]
+        self.reset_options()
+
+    def reset_options(self):
+        """
+        Restore the default options and settings so the same instance can be
+        reused for another conversion instead of building a new one
+        """
+        self.options = {
+            'fix-html': True,
+            'images': True,
+            'tables': True,
+            'styles': True,
+        }
         self.table_style = DEFAULT_TABLE_STYLE
+        self.html_parser = DEFAULT_HTML_PARSER
+        # drop any html left unprocessed by a previous feed
+        self.reset()
 
     def set_initial_attrs(self, document=None):
         self.tags = {
@@ -66,7 +111,7 @@ class HtmlToDocx(HTMLParser):
         self.doc = document if document else Document()
         self.document = self.doc
         self.bs = self.options['fix-html'] # whether or not to clean with BeautifulSoup
-        self.include_tables = True # TODO add this option back in?
+        self.include_tables = self.options['tables']
         self.include_images = self.options['images']
         self.include_styles = self.options['styles']
         self.paragraph = None
@@ -78,6 +123,7 @@ class HtmlToDocx(HTMLParser):
     def copy_settings_from(self, other):
         """Copy settings from another instance of HtmlToDocx"""
         self.table_style = other.table_style
+        self.html_parser = other.html_parser
 
     def get_cell_html(self, soup):
         """
@@ -87,7 +133,9 @@ class HtmlToDocx(HTMLParser):
         """
         return ' '.join([str(i) for i in soup.contents])
 
-    def unit_converter(self, unit: str, value: int):
+    @staticmethod
+    @lru_cache(maxsize=256)
+    def unit_converter(unit: str, value: int):
         result = None
         if unit == 'px':
             result = Inches(min(value // 10 * INDENT, MAX_INDENT))
@@ -132,8 +180,8 @@ class HtmlToDocx(HTMLParser):
                 self.paragraph.paragraph_format.alignment = WD_ALIGN_PARAGRAPH.CENTER
         elif 'margin-left' in style:
             margin = utils.remove_important_from_style(style['margin-left'])
-            units = re.sub(r'[0-9]+', '', margin)
-            margin = int(float(re.sub(r'[a-zA-Z\!\%]+', '', margin)))
+            units = DIGITS.sub('', margin)
+            margin = int(float(UNIT_CHARACTERS.sub('', margin)))
 
             self.paragraph.paragraph_format.left_indent = self.unit_converter(units, margin)
 
@@ -155,8 +203,8 @@ class HtmlToDocx(HTMLParser):
                 self.table.alignment = WD_ALIGN_PARAGRAPH.CENTER
         elif 'margin-left' in style:
             margin = utils.remove_important_from_style(style['margin-left'])
-            units = re.sub(r'[0-9]+', '', margin)
-            margin = int(float(re.sub(r'[a-zA-Z\!\%]+', '', margin)))
+            units = DIGITS.sub('', margin)
+            margin = int(float(UNIT_CHARACTERS.sub('', margin)))
 
             self.table.left_indent = self.unit_converter(units, margin)
 
@@ -166,15 +214,12 @@ class HtmlToDocx(HTMLParser):
             # Adapt font_size when text, ex.: small, medium, etc.
             font_size = utils.adapt_font_size(font_size)
 
-            units = re.sub(r'[0-9]+', '', font_size)
-            font_size = int(float(re.sub(r'[a-zA-Z\!\%]+', '', font_size)))
+            # Splits the size from its unit in one pass, e.g. '14.5pt' -> ('14.5', 'pt')
+            match = FONT_SIZE.fullmatch(font_size)
+            font_size_length = FONT_SIZE_UNITS.get(match.group(2)) if match else None
 
-            if units == 'px':
-                font_size_unit = Inches(utils.px_to_inches(font_size))
-            elif units == 'cm':
-                font_size_unit = Cm(font_size)
-            elif units == 'pt':
-                font_size_unit = Pt(font_size)
+            if font_size_length:
+                font_size_unit = font_size_length(float(match.group(1)))
             else:
                 # When unit is not supported
                 font_size_unit = None
@@ -184,38 +229,10 @@ class HtmlToDocx(HTMLParser):
                     run.font.size = font_size_unit
 
         if 'color' in style:
-            font_color = utils.remove_important_from_style(style['color'].lower())
-
-            if 'rgb' in font_color:
-                color = re.sub(r'[a-z()]+', '', font_color)
-                colors = [int(x) for x in color.split(',')]
-            elif '#' in font_color:
-                color = font_color.lstrip('#')
-                colors = RGBColor.from_string(color)
-            elif font_color in Color._member_names_:
-                colors = Color[font_color].value
-            else:
-                colors = [0, 0, 0]
-                # Set color to black to prevent crashing
-                # with inexpected colors
-
-            self.run.font.color.rgb = RGBColor(*colors)
+            self.run.font.color.rgb = RGBColor(*utils.parse_color(style['color']))
 
         if 'background-color' in style:
-            background_color = utils.remove_important_from_style(style['background-color'].lower())
-
-            if 'rgb' in background_color:
-                color = re.sub(r'[a-z()]+', '', background_color)
-                colors = [int(x) for x in color.split(',')]
-            elif '#' in background_color:
-                color = background_color.lstrip('#')
-                colors = RGBColor.from_string(color)
-            elif background_color in Color._member_names_:
-                colors = Color[background_color].value
-            else:
-                colors = [0, 0, 0]
-                # Set color to black to prevent crashing
-                # with inexpected colors
+            colors = utils.parse_color(style['background-color'])
 
             # Little trick to apply background-color to paragraph
             # because `self.run.font.highlight_color`
@@ -228,16 +245,19 @@ class HtmlToDocx(HTMLParser):
             shd.set(qn('w:color'), 'auto')
             shd.set(qn('w:fill'), utils.rgb_to_hex(colors))
 
-            # Make sure the paragraph styling element exists
-            self.paragraph.paragraph_format.element.get_or_add_pPr()
-
-            # Append the shading element
-            self.paragraph.paragraph_format.element.pPr.append(shd)
+            # Append the shading element, making sure the paragraph styling element exists.
+            # A paragraph has a single shading, nested spans replace the outer one
+            pPr = self.paragraph._p.get_or_add_pPr()
+            for previous_shd in pPr.findall(qn('w:shd')):
+                pPr.remove(previous_shd)
+            pPr.append(shd)
 
     def parse_dict_string(self, string, separator=';'):
-        new_string = string.replace(" ", '').split(separator)
-        string_dict = dict([x.split(':') for x in new_string if ':' in x])
-        return string_dict
+        if ':' not in string:
+            # empty or malformed style, nothing to split
+            return {}
+        # a fresh dict on every call, callers are free to change it
+        return dict(parse_declarations(string, separator))
 
     def handle_li(self):
         # check list stack to determine style and depth
@@ -275,8 +295,8 @@ class HtmlToDocx(HTMLParser):
         src = current_attrs['src']
 
         # added image dimension, interpreting values as pixel only
-        height = Pt(int(re.sub(r'[^0-9]+$', '', current_attrs['height']))) if 'height' in current_attrs else None
-        width = Pt(int(re.sub(r'[^0-9]+$', '', current_attrs['width']))) if 'width' in current_attrs else None
+        height = Pt(int(TRAILING_NON_DIGITS.sub('', current_attrs['height']))) if 'height' in current_attrs else None
+        width = Pt(int(TRAILING_NON_DIGITS.sub('', current_attrs['width']))) if 'width' in current_attrs else None
 
         # fetch image
         src_is_url = utils.is_url(src)
@@ -327,6 +347,24 @@ class HtmlToDocx(HTMLParser):
             if image_alignment == utils.ImageAlignment.CENTER:
                 last_paragraph.alignment = WD_ALIGN_PARAGRAPH.CENTER
 
+    def get_table_style_name(self):
+        table_style = self.table_style
+        if ' ' not in table_style:
+            # Fixed 'style lookup by style_id is deprecated.'
+            # https://stackoverflow.com/a/29567907/17274446
+            table_style = ' '.join(CAPITALIZED_WORD.findall(table_style))
+        return table_style
+
+    def check_table_style(self, html):
+        """Fails before any html is parsed when table_style is not a style of the document"""
+        # tables are only built from a soup, without one the style is never used
+        has_soup = self.bs or isinstance(html, BeautifulSoup)
+        if (
+            self.include_tables and has_soup and self.table_style
+            and self.get_table_style_name() not in self.doc.part.styles
+        ):
+            raise ValueError(f"Unable to apply style {self.table_style}.")
+
     def handle_table(self, current_attrs):
         """
         To handle nested tables, we will parse tables manually as follows:
@@ -341,15 +379,14 @@ class HtmlToDocx(HTMLParser):
 
         if self.table_style:
             try:
-                # Fixed 'style lookup by style_id is deprecated.'
-                # https://stackoverflow.com/a/29567907/17274446
-                self.table_style = ' '.join(re.findall(r'[A-Z][^A-Z]*', self.table_style))
+                self.table.style = self.get_table_style_name()
             except KeyError as e:
                 raise ValueError(f"Unable to apply style {self.table_style}.") from e
 
         rows = self.get_table_rows(table_soup)
         cell_row = 0
         docx_cells = self.table._cells
+        column_count = self.table._column_count
         for row in rows:
             cols = self.get_table_columns(row)
             cell_col = 0
@@ -357,7 +394,7 @@ class HtmlToDocx(HTMLParser):
                 cell_html = self.get_cell_html(col)
                 if col.name == 'th':
                     cell_html = "<b>%s</b>" % cell_html
-                docx_cell = docx_cells[cell_col + (cell_row * self.table._column_count)]
+                docx_cell = docx_cells[cell_col + (cell_row * column_count)]
                 child_parser = HtmlToDocx()
                 child_parser.copy_settings_from(self)
                 child_parser.add_html_to_cell(cell_html, docx_cell)
@@ -368,8 +405,8 @@ class HtmlToDocx(HTMLParser):
             style = self.parse_dict_string(current_attrs['style'])
             self.add_styles_to_table(style)
 
-        # skip all tags until corresponding closing tag
-        self.instances_to_skip = len(table_soup.find_all('table'))
+        # skip all tags until corresponding closing tag, nested tables are counted on the way
+        self.instances_to_skip = 0
         self.skip_tag = 'table'
         self.skip = True
         self.table = None
@@ -434,6 +471,9 @@ class HtmlToDocx(HTMLParser):
 
     def handle_starttag(self, tag, attrs):
         if self.skip:
+            if tag == self.skip_tag:
+                # nested tag with the same name, its closing tag must not end the skip
+                self.instances_to_skip += 1
             return
         if tag == 'head':
             self.skip = True
@@ -490,7 +530,7 @@ class HtmlToDocx(HTMLParser):
             bottom.set(qn('w:color'), 'auto')
             pBdr.append(bottom)
 
-        elif re.match('h[1-9]', tag):
+        elif HEADING_TAG.match(tag):
             if isinstance(self.doc, docx.document.Document):
                 h_size = int(tag[1])
                 self.paragraph = self.doc.add_heading(level=min(h_size, 9))
@@ -502,7 +542,12 @@ class HtmlToDocx(HTMLParser):
             self.paragraph = self.doc.paragraphs[-1]
 
         elif tag == 'table':
-            self.handle_table(current_attrs)
+            if self.include_tables:
+                self.handle_table(current_attrs)
+            else:
+                self.skip = True
+                self.skip_tag = tag
+                self.instances_to_skip = 0
             return
 
         elif tag == 'div':
@@ -544,7 +589,8 @@ class HtmlToDocx(HTMLParser):
             utils.remove_last_occurence(self.tags['list'], tag)
             return
         elif tag == 'table':
-            self.table_no += 1
+            if self.include_tables:
+                self.table_no += 1
             self.table = None
             self.doc = self.document
             self.paragraph = None
@@ -581,14 +627,15 @@ class HtmlToDocx(HTMLParser):
                     self.add_styles_to_run(style)
 
             # add font style and name
+            font = self.run.font
             for tag in self.tags:
                 if tag in utils.font_styles:
                     font_style = utils.font_styles[tag]
-                    setattr(self.run.font, font_style, True)
+                    setattr(font, font_style, True)
 
                 if tag in utils.font_names:
                     font_name = utils.font_names[tag]
-                    self.run.font.name = font_name
+                    font.name = font_name
 
     def ignore_nested_tables(self, tables_soup):
         """
@@ -630,7 +677,7 @@ class HtmlToDocx(HTMLParser):
         return len(rows), cols
 
     def get_tables(self):
-        if not hasattr(self, 'soup'):
+        if self.soup is None:
             self.include_tables = False
             return
             # find other way to do it, or require this dependency?
@@ -638,20 +685,32 @@ class HtmlToDocx(HTMLParser):
         self.table_no = 0
 
     def run_process(self, html):
-        if self.bs and BeautifulSoup:
-            self.soup = BeautifulSoup(html, 'html.parser')
+        if isinstance(html, BeautifulSoup):
+            # already parsed by the caller, reuse the tree instead of parsing it again
+            self.soup = html
             html = str(self.soup)
+        elif self.bs and BeautifulSoup:
+            self.soup = BeautifulSoup(html, self.html_parser)
+            html = str(self.soup)
+        else:
+            # drop the soup of a previous run, tables are skipped without one
+            self.soup = None
+            if isinstance(html, bytes):
+                # detect the encoding the same way BeautifulSoup does when cleaning the html
+                html = UnicodeDammit(html).unicode_markup
         if self.include_tables:
             self.get_tables()
         self.feed(html)
 
     def add_html_to_document(self, html, document):
-        if not isinstance(html, str):
-            raise ValueError(f'First argument needs to be a {str}')
+        if not isinstance(html, (str, bytes, BeautifulSoup)):
+            raise ValueError(f'First argument needs to be a {str}, {bytes} or {BeautifulSoup}')
         elif not isinstance(document, docx.document.Document) and not isinstance(document, docx.table._Cell):
             raise ValueError(f'Second argument needs to be a {docx.document.Document}')
         self.set_initial_attrs(document)
+        self.check_table_style(html)
         self.run_process(html)
+        return self.doc
 
     def add_html_to_cell(self, html, cell):
         if not isinstance(cell, docx.table._Cell):
@@ -669,6 +728,7 @@ class HtmlToDocx(HTMLParser):
         with open(filename_html, 'r', encoding=encoding) as infile:
             html = infile.read()
         self.set_initial_attrs()
+        self.check_table_style(html)
         self.run_process(html)
         if not filename_docx:
             path, filename = os.path.split(filename_html)
@@ -677,6 +737,7 @@ class HtmlToDocx(HTMLParser):
 
     def parse_html_string(self, html):
         self.set_initial_attrs()
+        self.check_table_style(html)
         self.run_process(html)
         return self.doc
 
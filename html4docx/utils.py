@@ -4,8 +4,20 @@ import urllib.request
 
 from io import BytesIO
 from enum import Enum
+from functools import lru_cache
 from urllib.parse import urlparse
 
+from docx.shared import RGBColor
+
+from html4docx.colors import COLOR_NAMES
+
+RGB_CHARACTERS = re.compile(r'[a-z()]+')
+IMPORTANT = re.compile('!important', re.IGNORECASE)
+LEADING_NEW_LINES = re.compile(r'^\s*\n+\s*')
+TRAILING_NEW_LINES = re.compile(r'\s*\n+\s*$')
+NEW_LINE = re.compile(r'\s*\n\s*')
+WHITESPACE = re.compile(r'\s+')
+
 font_styles = {
     'b': 'bold',
     'strong': 'bold',
@@ -54,12 +66,31 @@ def is_url(url):
     parts = urlparse(url)
     return all([parts.scheme, parts.netloc, parts.path])
 
+def px_to_emu(px):
+    # 1px is 1/96 inch and an inch has 914400 EMUs, so integer px stay exact
+    return px * 9525
+
 def px_to_inches(px):
-    return px * 0.0104166667
+    return px_to_emu(px) / 914400
 
 def rgb_to_hex(rgb):
     return '#' + ''.join(f'{i:02X}' for i in rgb)
 
+@lru_cache(maxsize=1024)
+def parse_color(color):
+    """
+    Converts a css color value (rgb(), hex or name) to a (r, g, b) tuple.
+    Unknown colors are black, to prevent crashing with inexpected colors.
+    Cached since documents usually repeat the same few colors.
+    """
+    color = remove_important_from_style(color.lower())
+
+    if 'rgb' in color:
+        return tuple(int(x) for x in RGB_CHARACTERS.sub('', color).split(','))
+    if '#' in color:
+        return tuple(RGBColor.from_string(color.lstrip('#')))
+    return COLOR_NAMES.get(color, (0, 0, 0))
+
 def adapt_font_size(size):
     if (size in font_sizes_named.keys()):
         return font_sizes_named[size]
@@ -67,7 +98,10 @@ def adapt_font_size(size):
     return size
 
 def remove_important_from_style(text):
-    return re.sub('!important', '', text, flags=re.IGNORECASE)
+    if '!' not in text:
+        # most values have no flag at all, skip the regex
+        return text
+    return IMPORTANT.sub('', text)
 
 def fetch_image(url):
     """
@@ -140,16 +174,16 @@ def remove_whitespace(string, leading=False, trailing=False):
     """
     # Remove any leading new line characters along with any surrounding white space
     if leading:
-        string = re.sub(r'^\s*\n+\s*', '', string)
+        string = LEADING_NEW_LINES.sub('', string)
 
     # Remove any trailing new line characters along with any surrounding white space
     if trailing:
-        string = re.sub(r'\s*\n+\s*$', '', string)
+        string = TRAILING_NEW_LINES.sub('', string)
 
     # Replace new line characters and absorb any surrounding space.
-    string = re.sub(r'\s*\n\s*', ' ', string)
+    string = NEW_LINE.sub(' ', string)
     # TODO need some way to get rid of extra spaces in e.g. text <span>   </span>  text
-    return re.sub(r'\s+', ' ', string)
+    return WHITESPACE.sub(' ', string)
 
 def delete_paragraph(paragraph):
     # https://github.com/python-openxml/python-docx/issues/33#issuecomment-77661907
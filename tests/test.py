@@ -1,38 +1,81 @@
+import copy
 import os
+from functools import lru_cache
 from pathlib import Path
 import unittest
+from bs4 import BeautifulSoup
 from docx import Document
-from html4docx import HtmlToDocx
+from docx.shared import Cm, Inches, Pt, RGBColor
+from docx.table import Table
+from docx.oxml.ns import nsmap, qn
+from lxml import etree
+from html4docx import HtmlToDocx, utils
+from html4docx.h4d import DEFAULT_HTML_PARSER
 from .context import test_dir
 
+# Set H4D_VISUAL=1 to save each OutputTest document to <test name>.docx for human validation
+RUN_VISUAL = os.environ.get('H4D_VISUAL') == '1'
+
+# Namespace-qualified names used by the xml assertions, resolved once
+W_PBDR = qn('w:pBdr')
+W_SHD = qn('w:shd')
+W_FILL = qn('w:fill')
+W_DRAWING = qn('w:drawing')
+W_BOOKMARKSTART = qn('w:bookmarkStart')
+W_BOOKMARKEND = qn('w:bookmarkEnd')
+W_HYPERLINK = qn('w:hyperlink')
+W_ID = qn('w:id')
+W_NAME = qn('w:name')
+W_ANCHOR = qn('w:anchor')
+W_TOOLTIP = qn('w:tooltip')
+W_TBL = qn('w:tbl')
+
+# Half-point font size of the second run of a paragraph, empty when it has none, compiled once
+RUN_FONT_SIZE = etree.XPath('string(./w:r[2]/w:rPr/w:sz/@w:val)', namespaces=nsmap)
+
+ASSETS_DIR = Path(test_dir, 'assets', 'htmls')
+
+@lru_cache(maxsize=None)
+def get_html_from_file(filename: str):
+    # bytes are handed as is to BeautifulSoup, skipping a decode/encode round trip
+    return (ASSETS_DIR / filename).read_bytes()
+
+@lru_cache(maxsize=None)
+def get_soup_from_file(filename: str):
+    # parsed once and reused, the parser does not modify the soup it is given
+    return BeautifulSoup(get_html_from_file(filename), DEFAULT_HTML_PARSER)
+
 class OutputTest(unittest.TestCase):
-    @staticmethod
-    def clean_up_docx():
-        for filename in Path(test_dir).glob("*.docx"):
-            filename.unlink()
+    # table_style set on the parser -> name of the style the tables end up with
+    TABLE_STYLES = {None: 'Normal Table', 'Light Grid Accent 6': 'Light Grid Accent 6', 'TableGrid': 'Table Grid'}
 
     @staticmethod
-    def get_html_from_file(filename: str):
-        file_path = Path(f'{test_dir}/assets/htmls') / Path(filename)
-        with open(file_path, 'r') as f:
-            html = f.read()
-        return html
+    def clean_up_docx():
+        with os.scandir(test_dir) as entries:
+            for entry in entries:
+                if entry.name.endswith('.docx') and entry.is_file(follow_symlinks=False):
+                    os.unlink(entry.path)
 
     @classmethod
     def setUpClass(cls):
         cls.clean_up_docx()
-        cls.document = Document()
-        cls.text1 = cls.get_html_from_file('text1.html')
-        cls.table_html = cls.get_html_from_file('tables1.html')
-        cls.table2_html = cls.get_html_from_file('tables2.html')
-
-    @classmethod
-    def tearDownClass(cls):
-        outputpath = os.path.join(test_dir, 'test.docx')
-        cls.document.save(outputpath)
+        cls.parser = HtmlToDocx()
+        # copying an empty document is about twice as fast as loading the default template again
+        cls.empty_document = Document()
+        cls.text1 = get_soup_from_file('text1.html')
+        cls.table_html = get_soup_from_file('tables1.html')
 
     def setUp(self):
-        self.parser = HtmlToDocx()
+        # A document per test keeps tests independent of each other and of their order
+        self.document = copy.deepcopy(self.empty_document)
+        self.parser.reset_options()
+
+    def tearDown(self):
+        # Nothing to look at when the test failed before adding content
+        if not RUN_VISUAL or not (self.document.paragraphs or self.document.tables):
+            return
+        outputpath = os.path.join(test_dir, f'{self._testMethodName}.docx')
+        self.document.save(outputpath)
 
     def test_html_with_images_links_style(self):
         self.document.add_heading(
@@ -68,60 +111,29 @@ class OutputTest(unittest.TestCase):
         cell = table.cell(1, 1)
         self.parser.add_html_to_document(self.text1, cell)
 
-    def test_add_html_skip_images(self):
-        self.document.add_heading(
-            'Test: regular html with images, but skip adding images',
-            level=1
-        )
-        self.parser.options['images'] = False
-        self.parser.add_html_to_document(self.text1, self.document)
-
-        document = self.parser.parse_html_string(self.text1)
-        assert any(['Graphic' in paragraph._p.xml for paragraph in document.paragraphs]) is False
-
     def test_add_html_with_tables(self):
-        self.document.add_heading(
-            'Test: add html with tables',
-            level=1
-        )
-        self.parser.add_html_to_document(self.table_html, self.document)
-
-    def test_add_html_with_tables_accent_style(self):
-        self.document.add_heading(
-            'Test: add html with tables with accent',
-        )
-        self.parser.table_style = 'Light Grid Accent 6'
-        self.parser.add_html_to_document(self.table_html, self.document)
-
-    def test_add_html_with_tables_basic_style(self):
-        self.document.add_heading(
-            'Test: add html with tables with basic style',
-        )
-        self.parser.table_style = 'TableGrid'
-        self.parser.add_html_to_document(self.table_html, self.document)
-
-    def test_add_nested_tables(self):
-        self.document.add_heading(
-            'Test: add nested tables',
-        )
-        self.parser.add_html_to_document(self.table2_html, self.document)
-
-    def test_add_nested_tables_basic_style(self):
-        self.document.add_heading(
-            'Test: add nested tables with basic style',
-        )
-        self.parser.table_style = 'TableGrid'
-        self.parser.add_html_to_document(self.table2_html, self.document)
-
-    def test_add_nested_tables_accent_style(self):
-        self.document.add_heading(
-            'Test: add nested tables with accent style',
-        )
-        self.parser.table_style = 'Light Grid Accent 6'
-        self.parser.add_html_to_document(self.table2_html, self.document)
+        for fixture in ('tables1.html', 'tables2.html'):
+            html = get_soup_from_file(fixture)
+            for table_style, expected_style in self.TABLE_STYLES.items():
+                with self.subTest(fixture=fixture, table_style=table_style):
+                    self.document.add_heading(
+                        f'Test: add {fixture} with table style {table_style}',
+                        level=1
+                    )
+                    self.parser.table_style = table_style
+                    tables_before = len(self.document.tables)
+                    self.parser.add_html_to_document(html, self.document)
+
+                    # document.tables only holds body level tables, nested ones are found in their xml
+                    tables = [
+                        Table(tbl, table._parent)
+                        for table in self.document.tables[tables_before:]
+                        for tbl in table._tbl.iter(W_TBL)
+                    ]
+                    assert len(tables) > len(self.document.tables) - tables_before
+                    assert all(table.style.name == expected_style for table in tables)
 
     def test_add_html_skip_tables(self):
-        # broken until feature readded
         self.document.add_heading(
             'Test: add html with tables, but skip adding tables',
             level=1
@@ -129,23 +141,8 @@ class OutputTest(unittest.TestCase):
         self.parser.options['tables'] = False
         self.parser.add_html_to_document(self.table_html, self.document)
 
-    def test_wrong_argument_type_raises_error(self):
-        try:
-            self.parser.add_html_to_document(self.document, self.text1)
-        except Exception as e:
-            assert isinstance(e, ValueError)
-            assert "First argument needs to be a <class 'str'>" in str(e)
-        else:
-            assert False, "Error not raised as expected"
-
-        try:
-            self.parser.add_html_to_document(self.text1, self.text1)
-        except Exception as e:
-            assert isinstance(e, ValueError)
-            assert "Second argument" in str(e)
-            assert "<class 'docx.document.Document'>" in str(e)
-        else:
-            assert False, "Error not raised as expected"
+        assert not self.document.tables
+        assert len(self.document.paragraphs) > 1
 
     def test_add_html_to_cells_method(self):
         self.document.add_heading(
@@ -207,30 +204,82 @@ and blank lines.
 """
         self.parser.add_html_to_document(html, self.document)
 
-    def test_handling_hr(self):
-        hr_html_example = '<p>paragraph</p><hr><p>paragraph</p>'
-
+    def test_unbalanced_table(self):
+        # A table with more td elements in latter rows than in the first
         self.document.add_heading(
-            'Test: Handling of hr',
+            'Test: Handling unbalanced tables',
             level=1
         )
-        # Add on document for human validation
-        self.parser.add_html_to_document(hr_html_example, self.document)
+        document = self.parser.add_html_to_document(
+            "<table>"
+            "<tr><td>Hello</td></tr>"
+            "<tr><td>One</td><td>Two</td></tr>"
+            "</table>",
+            self.document
+        )
+
+        assert document is self.document
+        table = document.tables[-1]
+        assert (len(table.rows), len(table.columns)) == (2, 2)
+
+class ParseOnlyTest(unittest.TestCase):
+    """
+    Tests that only assert on the document returned by the parser.
+    They share no document, so they can run in any order or in parallel.
+    """
+    # inline style -> color of the styled run
+    COLOR_STYLES = (
+        ('color:red', RGBColor(0xFF, 0x00, 0x00)),
+        ('color: yellow', RGBColor(0xFF, 0xFF, 0x00)),
+        ('color: blue !important', RGBColor(0x00, 0x00, 0xFF)),
+        ('color: green!important', RGBColor(0x00, 0x80, 0x00)),
+        ('color: darkgray!IMPORTANT', RGBColor(0xA9, 0xA9, 0xA9)),
+        ('color: cyan', RGBColor(0x00, 0xFF, 0xFF)),
+        # default black because of invalid color name
+        ('color: invalidcolor', RGBColor(0x00, 0x00, 0x00)),
+    )
 
-        document = self.parser.parse_html_string(hr_html_example)
-        assert '<w:pBdr>' in document._body._body.xml
+    @classmethod
+    def setUpClass(cls):
+        cls._parsed_cache = {}
+        cls.parser = HtmlToDocx()
+        cls.text1 = get_html_from_file('text1.html')
+
+    def setUp(self):
+        self.parser.reset_options()
+
+    def cached_parse(self, html):
+        """
+        Returns the document parsed from html, reusing a previous result when the same
+        html was already parsed with the same parser settings. Documents are only read.
+        """
+        key = (html, tuple(sorted(self.parser.options.items())), self.parser.table_style)
+        if key not in self._parsed_cache:
+            self._parsed_cache[key] = self.parser.parse_html_string(html)
+        return self._parsed_cache[key]
+
+    def test_add_html_skip_images(self):
+        self.parser.options['images'] = False
+        document = self.cached_parse(self.text1)
+        assert document.element.body.find('.//' + W_DRAWING) is None
+
+    def test_wrong_argument_type_raises_error(self):
+        with self.assertRaisesRegex(ValueError, "First argument needs to be a <class 'str'>"):
+            self.parser.add_html_to_document(Document(), self.text1)
+
+        with self.assertRaisesRegex(ValueError, "Second argument.*<class 'docx.document.Document'>"):
+            self.parser.add_html_to_document(self.text1, self.text1)
+
+    def test_handling_hr(self):
+        hr_html_example = '<p>paragraph</p><hr><p>paragraph</p>'
+
+        document = self.cached_parse(hr_html_example)
+        assert document.element.body.find('.//' + W_PBDR) is not None
 
     def test_external_hyperlink(self):
         hyperlink_html_example = "<a href=\"https://www.google.com\">Google External Link</a>"
 
-        self.document.add_heading(
-            'Test: Handling external hyperlink',
-            level=1
-        )
-        # Add on document for human validation
-        self.parser.add_html_to_document(hyperlink_html_example, self.document)
-
-        document = self.parser.parse_html_string(hyperlink_html_example)
+        document = self.cached_parse(hyperlink_html_example)
         # Extract external hyperlinks
         external_hyperlinks = []
 
@@ -239,7 +288,7 @@ and blank lines.
                 external_hyperlinks.append(rel.target_ref)
 
         assert 'https://www.google.com' in external_hyperlinks
-        assert '<w:hyperlink' in document._body._body.xml
+        assert document.element.body.find('.//' + W_HYPERLINK) is not None
 
     def test_internal_hyperlink(self):
         hyperlink_html_example = (
@@ -247,28 +296,22 @@ and blank lines.
             "<p>Click here: <a href=\"#intro\" title=\"Link to intro\">Link to intro</a></p>"
         )
 
-        self.document.add_heading(
-            'Test: Handling internal hyperlink',
-            level=1
-        )
-        # Add on document for human validation
-        self.parser.add_html_to_document(hyperlink_html_example, self.document)
+        document = self.cached_parse(hyperlink_html_example)
+        document_body = document.element.body
 
-        document = self.parser.parse_html_string(hyperlink_html_example)
-        document_body = document._body._body.xml
-        assert '<w:bookmarkStart w:id="0" w:name="intro"/>' in document_body
-        assert '<w:bookmarkEnd w:id="0"/>' in document_body
-        assert '<w:hyperlink w:anchor="intro" w:tooltip="Link to intro">' in document_body
+        bookmark_start = document_body.find('.//' + W_BOOKMARKSTART)
+        assert bookmark_start.get(W_ID) == '0'
+        assert bookmark_start.get(W_NAME) == 'intro'
 
-    def test_image_no_src(self):
-        self.document.add_heading(
-            'Test: Handling img without src',
-            level=1
-        )
-        # Add on document for human validation
-        self.parser.add_html_to_document('<img />', self.document)
+        bookmark_end = document_body.find('.//' + W_BOOKMARKEND)
+        assert bookmark_end.get(W_ID) == '0'
 
-        document = self.parser.parse_html_string('<img />')
+        hyperlink = document_body.find('.//' + W_HYPERLINK)
+        assert hyperlink.get(W_ANCHOR) == 'intro'
+        assert hyperlink.get(W_TOOLTIP) == 'Link to intro'
+
+    def test_image_no_src(self):
+        document = self.cached_parse('<img />')
         assert '<image: no_src>' in document.paragraphs[0].text
 
     def test_font_size(self):
@@ -278,59 +321,164 @@ and blank lines.
             "<p><span style=\"font-size: 12em !important\">paragraph 12em not supported</span></p>"
             "<p><span style=\"font-size:14pt!important\">paragraph 14pt</span></p>"
             "<p><span style=\"font-size: 16pt!IMPORTANT\">paragraph 16pt</span></p>"
+            "<p><span style=\"font-size: 10.5pt\">paragraph 10.5pt</span></p>"
+            "<p><span style=\"font-size: inherit\">paragraph inherit not supported</span></p>"
         )
 
-        self.document.add_heading(
-            'Test: Font-Size',
-            level=1
+        document = self.cached_parse(font_size_html_example)
+        # w:sz is in half-points, paragraphs with unsupported sizes get no size at all
+        font_sizes = [RUN_FONT_SIZE(paragraph._p) for paragraph in document.paragraphs]
+        assert ['12', '56', '', '28', '32', '21', ''] == font_sizes
+
+    def test_color_by_name(self):
+        color_html_example = ''.join(
+            f'<p><span style="{style}">paragraph</span></p>' for style, _ in self.COLOR_STYLES
         )
-        # Add on document for human validation
-        self.parser.add_html_to_document(font_size_html_example, self.document)
 
-        document = self.parser.parse_html_string(font_size_html_example)
-        font_sizes = [str(p.runs[1].font.size) for p in document.paragraphs]
-        assert ['76200', '355600', 'None', '177800', '203200'] == font_sizes
+        document = self.cached_parse(color_html_example)
+        assert len(document.paragraphs) == len(self.COLOR_STYLES)
 
-    def test_color_by_name(self):
-        color_html_example = (
-            "<p><span style=\"color:red\">paragraph red</span></p>"
-            "<p><span style=\"color: yellow\">paragraph yellow</span></p>"
-            "<p><span style=\"color: blue !important\">paragraph blue</span></p>"
-            "<p><span style=\"color: green!important\">paragraph green</span></p>"
-            "<p><span style=\"color: darkgray!IMPORTANT\">paragraph darkgray</span></p>"
-            "<p><span style=\"color: invalidcolor\">paragraph has default black because of invalid color name</span></p>"
+        for (style, expected_color), paragraph in zip(self.COLOR_STYLES, document.paragraphs):
+            with self.subTest(style=style):
+                assert paragraph.runs[1].font.color.rgb == expected_color
+
+    def test_unknown_table_style(self):
+        self.parser.table_style = 'NonExistentStyle'
+        document = Document()
+
+        with self.assertRaisesRegex(ValueError, 'Unable to apply style NonExistentStyle'):
+            self.parser.add_html_to_document('<p>paragraph</p><table><tr><td>cell</td></tr></table>', document)
+        # nothing was converted before failing
+        assert not document.paragraphs and not document.tables
+
+    def test_unknown_table_style_without_tables(self):
+        # the style is never used when tables are skipped, so it is not checked either
+        self.parser.table_style = 'NonExistentStyle'
+        self.parser.options['tables'] = False
+        document = self.parser.parse_html_string('<p>paragraph</p><table><tr><td>cell</td></tr></table>')
+        assert document.paragraphs[0].text == 'paragraph'
+        assert not document.tables
+
+    def test_unknown_table_style_without_fix_html(self):
+        # tables are skipped without the cleaned soup, so the style is not checked either
+        self.parser.table_style = 'NonExistentStyle'
+        self.parser.options['fix-html'] = False
+        for html in ('<p>paragraph</p>', '<p>paragraph</p><table><tr><td>cell</td></tr></table>'):
+            with self.subTest(html=html):
+                document = self.parser.parse_html_string(html)
+                assert document.paragraphs[0].text == 'paragraph'
+                assert not document.tables
+
+        # an already parsed soup still builds tables, so the style is checked
+        with self.assertRaisesRegex(ValueError, 'Unable to apply style NonExistentStyle'):
+            self.parser.parse_html_string(BeautifulSoup('<table><tr><td>cell</td></tr></table>', DEFAULT_HTML_PARSER))
+
+    def test_tables_without_fix_html(self):
+        self.parser.options['fix-html'] = False
+        document = self.parser.parse_html_string(
+            '<p>before</p><table><tr><td><table><tr><td>nested</td></tr></table></td></tr></table><p>after</p>'
         )
 
-        self.document.add_heading(
-            'Test: Color by name',
-            level=1
+        assert not document.tables
+        assert [p.text for p in document.paragraphs] == ['before', 'after']
+
+    def test_nested_span_styles(self):
+        document = self.cached_parse(
+            '<p><span style="color: red; background-color: yellow">'
+            '<span style="color: blue; background-color: green">paragraph</span></span></p>'
         )
-        # Add on document for human validation
-        self.parser.add_html_to_document(color_html_example, self.document)
+        paragraph = document.paragraphs[0]
+        shading = paragraph._p.pPr.findall(W_SHD)
 
-        document = self.parser.parse_html_string(color_html_example)
-        colors = [str(p.runs[1].font.color.rgb) for p in document.paragraphs]
+        assert str(paragraph.runs[-1].font.color.rgb) == '0000FF'
+        assert len(shading) == 1
+        assert shading[0].get(W_FILL) == '#008000'
 
-        assert 'FF0000' in colors # Red
-        assert 'FFFF00' in colors # Yellow
-        assert '0000FF' in colors # Blue
-        assert '008000' in colors # Green
-        assert 'A9A9A9' in colors # Darkgray
-        assert '000000' in colors # Black
+    def test_nested_span_unsupported_font_size(self):
+        # the inner size is not supported, so the outer one still applies
+        for inner_size in ('2em', 'inherit', '50%', '2rem'):
+            with self.subTest(inner_size=inner_size):
+                document = self.cached_parse(
+                    f'<p><span style="font-size:20px"><span style="font-size:{inner_size}">x</span></span></p>'
+                )
+                assert document.paragraphs[0].runs[-1].font.size == 190500
 
-    def test_unbalanced_table(self):
-        # A table with more td elements in latter rows than in the first
-        self.document.add_heading(
-            'Test: Handling unbalanced tables',
-            level=1
-        )
-        self.parser.add_html_to_document(
-            "<table>"
-            "<tr><td>Hello</td></tr>"
-            "<tr><td>One</td><td>Two</td></tr>"
-            "</table>",
-            self.document
+    def test_html_as_bytes(self):
+        document = self.parser.parse_html_string('<p>Olá <b>mundo</b></p>'.encode())
+        assert document.paragraphs[0].text == 'Olá mundo'
+
+        self.parser.options['fix-html'] = False
+        document = self.parser.parse_html_string('<p>Olá <b>mundo</b></p>'.encode())
+        assert document.paragraphs[0].text == 'Olá mundo'
+
+        # not utf-8, the encoding is detected instead of failing to decode
+        document = self.parser.parse_html_string('<p>Olá <b>mundo</b></p>'.encode('latin-1'))
+        assert document.paragraphs[0].text == 'Olá mundo'
+
+    def test_html_as_soup(self):
+        table_html = get_html_from_file('tables1.html')
+        soup = BeautifulSoup(table_html, DEFAULT_HTML_PARSER)
+        document = self.parser.parse_html_string(soup)
+        assert len(document.tables) == len(self.cached_parse(table_html).tables)
+
+        document = self.parser.add_html_to_document(soup, Document())
+        assert document.paragraphs[0].text == self.cached_parse(table_html).paragraphs[0].text
+
+    def test_html_parser(self):
+        lxml_document = self.parser.parse_html_string(self.text1)
+        self.parser.html_parser = 'html.parser'
+        html_parser_document = self.parser.parse_html_string(self.text1)
+
+        assert [p.text for p in html_parser_document.paragraphs] == [p.text for p in lxml_document.paragraphs]
+
+class UtilsTest(unittest.TestCase):
+    """Tests for the helpers of the parser, no document is parsed"""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.parser = HtmlToDocx()
+
+    def test_parse_color(self):
+        assert utils.parse_color('rgb(235, 107, 86)') == (235, 107, 86)
+        assert utils.parse_color('#A9A9A9 !important') == (169, 169, 169)
+        assert utils.parse_color('Cyan') == (0, 255, 255)
+        assert utils.parse_color('invalidcolor') == (0, 0, 0)
+
+    def test_parse_dict_string(self):
+        style = self.parser.parse_dict_string(
+            'color: blue !important;; font-size:8px; background: url(https://example.com/a.png);'
         )
+        assert style == {
+            'color': 'blue!important',
+            'font-size': '8px',
+            'background': 'url(https://example.com/a.png)',
+        }
+        assert self.parser.parse_dict_string('text-align, center', separator=',') == {}
+        assert self.parser.parse_dict_string('') == {}
+
+        # parsed styles are cached, changing a result must not leak into the next one
+        self.parser.parse_dict_string('color: red')['color'] = 'blue'
+        assert self.parser.parse_dict_string('color: red') == {'color': 'red'}
+        assert self.parser.parse_dict_string('text-align: center, color: red', separator=',') == {
+            'text-align': 'center',
+            'color': 'red',
+        }
+
+    def test_unit_converter(self):
+        assert self.parser.unit_converter('px', 20) == Inches(0.5)
+        assert self.parser.unit_converter('cm', 20) == Cm(0.5 * 2.54)
+        assert self.parser.unit_converter('pt', 15) == Pt(18)
+        assert self.parser.unit_converter('em', 2) is None
+
+    def test_reset_options(self):
+        self.parser.options['images'] = False
+        self.parser.table_style = 'TableGrid'
+        self.parser.html_parser = 'html.parser'
+        self.parser.reset_options()
+
+        assert self.parser.options['images'] is True
+        assert self.parser.table_style is None
+        assert self.parser.html_parser == DEFAULT_HTML_PARSER
 
 if __name__ == '__main__':
     unittest.main()
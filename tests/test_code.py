@@ -1,10 +1,12 @@
-import os
+from pathlib import Path
 from html4docx import HtmlToDocx
 from .context import test_dir
 
 # Manual test (requires inspection of result) for converting code and pre blocks.
+# Run it with `python -m tests.test_code`, it does nothing when collected by a test runner.
 
-filename = os.path.join(f'{test_dir}/assets/htmls', 'code.html')
-d = HtmlToDocx()
+if __name__ == '__main__':
+    filename = Path(test_dir, 'assets', 'htmls', 'code.html')
+    d = HtmlToDocx()
 
-d.parse_html_file(filename, f'{test_dir}/code')
+    d.parse_html_file(filename, f'{test_dir}/code')
@@ -1,10 +1,12 @@
-import os
+from pathlib import Path
 from html4docx import HtmlToDocx
 from .context import test_dir
 
 # Manual test (requires inspection of result) for converting html with nested tables
+# Run it with `python -m tests.test_tables`, it does nothing when collected by a test runner.
 
-filename = os.path.join(f'{test_dir}/assets/htmls', 'tables2.html')
-d = HtmlToDocx()
+if __name__ == '__main__':
+    filename = Path(test_dir, 'assets', 'htmls', 'tables2.html')
+    d = HtmlToDocx()
 
-d.parse_html_file(filename, f'{test_dir}/tables2')
+    d.parse_html_file(filename, f'{test_dir}/tables2')